@@ -1,11 +1,33 @@
+import sys
+
 from .anysnake import Anysnake
 from .parser import parse_requirements, parsed_to_anysnake
 
-from pkg_resources import get_distribution, DistributionNotFound
-try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
-    # package is not installed
-    pass
 
-__all__ = [Anysnake, parse_requirements, parsed_to_anysnake, __version__]
+def _get_version():
+    # pkg_resources takes longer to import than all of anysnake,
+    # so only pay for it when someone asks for the version
+    from pkg_resources import get_distribution, DistributionNotFound
+
+    try:
+        return get_distribution(__name__).version
+    except DistributionNotFound:
+        # package is not installed
+        raise AttributeError("__version__")
+
+
+def __getattr__(name):  # python >= 3.7
+    if name == "__version__":
+        global __version__
+        __version__ = _get_version()
+        return __version__
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+if sys.version_info < (3, 7):  # no module level __getattr__
+    try:
+        __version__ = _get_version()
+    except AttributeError:
+        pass
+
+__all__ = ["Anysnake", "parse_requirements", "parsed_to_anysnake", "__version__"]
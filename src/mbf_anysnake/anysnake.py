@@ -1,15 +1,17 @@
 # -*- coding: future_fstrings -*-
 from pathlib import Path
-from docker import from_env as docker_from_env
 import time
 import pwd
-import tempfile
+import hashlib
 import shutil
 import subprocess
+import tempfile
 import os
 import multiprocessing
 import sys
 import json
+import re
+import threading
 
 import mbf_anysnake
 from .dockfill_docker import DockFill_Docker
@@ -26,6 +28,48 @@ from .dockfill_rust import DockFill_Rust
 from .util import combine_volumes, get_next_free_port
 
 
+# scripts up to this size are passed to bash -c in _run_docker instead of
+# being mounted - well below linux' 128kb limit for a single argument
+_max_inline_script_length = 64 * 1024
+# see Anysnake._materialize_script
+_max_script_age = 7 * 24 * 3600
+
+
+def _annotate_hg(version):
+    return {"method": "hg", "url": version[3:]}
+
+
+def _annotate_git(version):
+    return {"method": "git", "url": version[4:]}
+
+
+def _annotate_github(version):
+    if "://" in version:
+        raise ValueError("Could not interpret %s" % version)
+    return {"method": "git", "url": "https://github.com/" + version}
+
+
+# see Anysnake.annotate_packages - group name -> annotation function
+_re_version = re.compile(r"(?P<hg>hg\+https)|(?P<git>git\+https)|(?P<github>.*/)")
+_version_methods = {
+    "hg": _annotate_hg,
+    "git": _annotate_git,
+    "github": _annotate_github,
+}
+
+
+def _annotate_entry(name, entry):
+    if "/" in name:
+        raise ValueError("invalid name: %s" % name)
+    version = entry["version"] or ""
+    m = _re_version.match(version)
+    if m:
+        annotation = _version_methods[m.lastgroup](version)
+    else:
+        annotation = {"method": "pip"}
+    return {**entry, "version": version, **annotation}
+
+
 class Anysnake:
     """Wrap ubuntu version (=docker image),
     Python version,
@@ -72,6 +116,12 @@ class Anysnake:
         self.cran_mirror = cran_mirror
         if not self.cran_mirror.endswith("/"):
             self.cran_mirror += "/"
+        self.r_base_url = f"{self.cran_mirror}src/base/"
+        self._docker_client = None  # see get_docker_client
+        # containers started by _run_docker, so ensure can kill them on ctrl-c
+        self._running_containers = set()
+        self._running_containers_lock = threading.Lock()
+        self._stop_containers = False
 
         self.storage_path = Path(storage_path)
         self.storage_per_hostname = storage_per_hostname
@@ -99,6 +149,9 @@ class Anysnake:
             "docker_code": code_path_docker,
             "log_storage": storage_path / "logs",
             "log_code": code_path / "logs",
+            # per user and keyed to the docker daemon -
+            # storage might be shared between machines
+            "docker_digests": per_user / "docker_digests",
             "per_user": per_user,
             "home_inside_docker": "/home/%s" % self.get_login_username(),
         }
@@ -108,6 +161,10 @@ class Anysnake:
         self.project_name = project_name
 
         self.python_version = python_version
+        parts = python_version.split(".")
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Error parsing {python_version} to major version")
+        self.major_python_version = ".".join(parts[:2])
         self.bioconductor_version = bioconductor_version
         self.global_python_packages = global_python_packages
         self.local_python_packages = local_python_packages
@@ -163,13 +220,24 @@ class Anysnake:
                 self.strategies.append(DockFill_Bioconductor(self, dfr))
 
         self.strategies.append(DockFill_Clone(self))
-        for k, v in self.paths.items():
-            self.paths[k] = Path(v)
         self.environment_variables = dict(environment_variables)
         for df in self.strategies:
             if hasattr(df, "env"):
                 self.environment_variables.update(df.env)
+        # the strategies are fixed from here on - precompute what every run needs
+        self._strategy_volumes = [df.volumes for df in self.strategies]
+        self._strategy_rw_volumes = [
+            df.rw_volumes for df in self.strategies if hasattr(df, "rw_volumes")
+        ]
+        self._path_str = (
+            ":".join(
+                [x.shell_path for x in self.strategies if hasattr(x, "shell_path")]
+            )
+            + ":$PATH"
+        )
 
+        # %md5sum% is the historic name of the placeholder -
+        # the tag is a sha256 of the Dockerfile (+sudoers) by now
         if docker_image.endswith(":%md5sum%"):
             docker_image = docker_image[: docker_image.rfind(":")]
             docker_image += ":" + dfd.get_dockerfile_hash(docker_image)
@@ -190,18 +258,56 @@ class Anysnake:
         # todo: modularize into dockerfills
 
     def ensure(self, do_time=False):
-        self.paths["storage"].mkdir(parents=True, exist_ok=True)
-        self.paths["code"].mkdir(parents=False, exist_ok=True)
+        import concurrent.futures
 
-        self.paths["log_storage"].mkdir(parents=False, exist_ok=True)
+        # creates storage as well
+        self.paths["log_storage"].mkdir(parents=True, exist_ok=True)
+        # but code's parent must already exist
+        self.paths["code"].mkdir(parents=False, exist_ok=True)
         self.paths["log_code"].mkdir(parents=False, exist_ok=True)
 
+        self._stop_containers = False  # see _kill_running_containers
+        # strategies run as soon as all their (present) deps are done,
+        # so e.g. the R build overlaps with the python build.
         run_post_build = False
-        for s in self.strategies:
-            start = time.time()
-            run_post_build |= s.ensure()
-            if do_time:
-                print(s.__class__.__name__, time.time() - start)
+        pending = list(self.strategies)
+        running = {}
+        # the builds use make -j cores themselves - don't run more than cores at once
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(pending), self.cores)
+        )
+        try:
+            while pending or running:
+                unfinished = pending + list(running.values())
+                for s in pending[:]:
+                    if not any(isinstance(o, s.deps) for o in unfinished):
+                        running[executor.submit(self._ensure_strategy, s, do_time)] = s
+                        pending.remove(s)
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for f in finished:
+                    del running[f]
+                    run_post_build |= f.result()
+        except KeyboardInterrupt:
+            # KeyboardInterrupt only ever reaches the main thread -
+            # stop the builds running in the workers ourselves,
+            # instead of waiting for them to finish
+            self._abort_strategies(executor, running)
+            raise
+        except Exception:
+            # a failed strategy should not throw away the others' progress
+            # (e.g. a long R compile) - let the running ones finish,
+            # but don't start any new ones
+            for f in running:
+                f.cancel()
+            try:
+                executor.shutdown(wait=True)
+            except KeyboardInterrupt:
+                self._abort_strategies(executor, running)
+                raise
+            raise
+        executor.shutdown(wait=True)
         if run_post_build and self.post_build_cmd:
             import subprocess
 
@@ -211,11 +317,70 @@ class Anysnake:
             )
             p.communicate()
 
+    def _abort_strategies(self, executor, running):
+        for f in running:
+            f.cancel()
+        self._kill_running_containers()
+        executor.shutdown(wait=False)
+
+    def _kill_running_containers(self):
+        """Kill all containers started by _run_docker
+        and refuse to start new ones"""
+        with self._running_containers_lock:
+            self._stop_containers = True
+            containers = list(self._running_containers)
+        for container in containers:
+            try:
+                container.kill()
+            except Exception:  # already gone
+                pass
+
+    def _ensure_strategy(self, strategy, do_time):
+        start = time.time()
+        res = strategy.ensure()
+        if do_time:
+            print(strategy.__class__.__name__, time.time() - start)
+        return res
+
     def ensure_just_docker(self):
         for s in self.strategies:
             if isinstance(s, DockFill_Docker):
                 s.ensure()
 
+    def ensure_just_docker_cached(self, max_age=3600):
+        """ensure_just_docker, but skip contacting the docker daemon
+        if the image was verified (on this docker daemon)
+        within the last max_age seconds"""
+        import socket
+
+        key = "\n".join(
+            [socket.gethostname(), os.environ.get("DOCKER_HOST", ""), self.docker_image]
+        )
+        digest_file = (
+            self.paths["docker_digests"]
+            / hashlib.sha256(key.encode("utf-8")).hexdigest()
+        )
+        try:
+            if time.time() - digest_file.stat().st_mtime < max_age:
+                return
+        except OSError:
+            pass
+        self.ensure_just_docker()
+        try:
+            # only the mtime matters - the name says what was verified
+            digest_file.parent.mkdir(parents=True, exist_ok=True)
+            digest_file.touch()
+        except OSError:  # not writable for us - just don't cache
+            pass
+
+    def get_docker_client(self):
+        """One docker client per Anysnake, created on first use"""
+        if self._docker_client is None:
+            from docker import from_env as docker_from_env
+
+            self._docker_client = docker_from_env()
+        return self._docker_client
+
     def rebuild(self):
         for s in self.strategies:
             if hasattr(s, "rebuild"):
@@ -254,25 +419,19 @@ class Anysnake:
         # dockerpty does not work with current docker-py
         # so we use the command line interface...
 
-        tf = tempfile.NamedTemporaryFile(mode="w")
-        path_str = (
-            ":".join(
-                [x.shell_path for x in self.strategies if hasattr(x, "shell_path")]
-            )
-            + ":$PATH"
+        script_file = self._materialize_script(
+            f"export PATH={self._path_str}\n"
+            + "umask 0002\n"  # allow sharing by default
+            + "source /anysnake/code_venv/bin/activate\n"
+            + bash_script
         )
-        tf.write(f"export PATH={path_str}\n")
-        tf.write(f"umask 0002\n")  # allow sharing by default
-        tf.write("source /anysnake/code_venv/bin/activate\n")
-        tf.write(bash_script)
         print("bash script running inside:\n", bash_script)
         print("")
-        tf.flush()
 
         home_inside_docker = self.paths["home_inside_docker"]
         ro_volumes = [
             {
-                "/anysnake/run.sh": tf.name,
+                "/anysnake/run.sh": str(script_file),
                 "/etc/passwd": "/etc/passwd",  # the users inside are the users outside
                 "/etc/group": "/etc/group",
                 "/etc/shadow": "/etc/shadow",
@@ -302,12 +461,10 @@ class Anysnake:
         # rw_volumes[0][target] = str(p)
 
         if allow_writes:
-            rw_volumes.extend([df.volumes for df in self.strategies])
+            rw_volumes.extend(self._strategy_volumes)
         else:
-            ro_volumes.extend([df.volumes for df in self.strategies])
-        rw_volumes.extend(
-            [df.rw_volumes for df in self.strategies if hasattr(df, "rw_volumes")]
-        )
+            ro_volumes.extend(self._strategy_volumes)
+        rw_volumes.extend(self._strategy_rw_volumes)
         ro_volumes.append(volumes_ro)
         rw_volumes.append(volumes_rw)
         volumes = combine_volumes(ro=ro_volumes, rw=rw_volumes)
@@ -319,16 +476,14 @@ class Anysnake:
             volumes.items(), key=lambda x: str(x[1])
         ):
             if Path(outside_path).exists():
-                cmd.append("-v")
-                cmd.append("%s:%s:%s" % (outside_path, inside_path, mode))
+                cmd += ["-v", f"{outside_path}:{inside_path}:{mode}"]
         if not "HOME" in env:
             env["HOME"] = home_inside_docker
         for key, value in sorted(env.items()):
-            cmd.append("-e")
-            cmd.append("%s=%s" % (key, value))
+            cmd += ["-e", f"{key}={value}"]
         if py_spy_support:
             cmd.extend(
-                [  # py-spy suppor"/home/u%i" % os.getuid()t
+                [  # py-spy support
                     "--cap-add=SYS_PTRACE",
                     "--security-opt=apparmor:unconfined",
                     "--security-opt=seccomp:unconfined",
@@ -338,9 +493,9 @@ class Anysnake:
         for from_port, to_port in self.ports:
             if from_port.endswith("+"):
                 from_port = get_next_free_port(int(from_port[:-1]))
-            cmd.extend(["-p", "%s:%s" % (from_port, to_port)])
+            cmd += ["-p", f"{from_port}:{to_port}"]
         for from_port, to_port in ports:
-            cmd.extend(["-p", "%s:%s" % (from_port, to_port)])
+            cmd += ["-p", f"{from_port}:{to_port}"]
 
         cmd.extend(["--workdir", "/project"])
         cmd.append("--network=bridge")
@@ -366,15 +521,15 @@ class Anysnake:
                     print("  " + x, end=" \\\n")
                 last_was_dash = False
         print("")
-        return cmd, tf
+        return cmd, script_file
 
     def run(self, *args, **kwargs):
-        cmd, tf = self._build_cmd(*args, **kwargs)
+        cmd, _ = self._build_cmd(*args, **kwargs)
         p = subprocess.Popen(cmd)
         p.communicate()
 
     def run_non_interactive(self, *args, **kwargs):
-        cmd, tf = self._build_cmd(*args, **kwargs)
+        cmd, _ = self._build_cmd(*args, **kwargs)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         return p.communicate()
 
@@ -382,10 +537,9 @@ class Anysnake:
         self, bash_script, run_kwargs, log_name, root=False, append_to_log=False
     ):
         docker_image = self.docker_image
-        client = docker_from_env()
-        tf = tempfile.NamedTemporaryFile(mode="w")
+        client = self.get_docker_client()
+        bash_script = "umask 0002\n" + bash_script  # allow sharing by default
         volumes = {
-            "/anysnake/run.sh": tf.name,
             "/etc/passwd": (
                 "/etc/passwd",
                 "ro",
@@ -395,35 +549,42 @@ class Anysnake:
             "/anysnake/gosu": str(self.paths["bin"] / "gosu-amd64"),
             Path("~").expanduser(): self.paths["home_inside_docker"],
         }
+        # the kernel's limit is in bytes, not characters
+        if len(bash_script.encode("utf-8")) < _max_inline_script_length:
+            bash_cmd = ["/bin/bash", "-c", bash_script]
+        else:
+            script_file = self._materialize_script(bash_script)
+            volumes["/anysnake/run.sh"] = (str(script_file), "ro")
+            bash_cmd = ["/bin/bash", "/anysnake/run.sh"]
         volumes.update(run_kwargs["volumes"])
         volume_args = {}
+        cwd = Path.cwd()
         for k, v in volumes.items():
-            k = str(Path(k).absolute())
+            k = Path(k)
+            if not k.is_absolute():
+                k = cwd / k
+            k = str(k)
             if isinstance(v, tuple):
-                volume_args[str(v[0])] = {"bind": str(k), "mode": v[1]}
+                volume_args[str(v[0])] = {"bind": k, "mode": v[1]}
             else:
                 volume_args[str(v)] = {"bind": k, "mode": "rw"}
         run_kwargs["volumes"] = volume_args
         # print(run_kwargs["volumes"])
         # if not root and not "user" in run_kwargs:
         # run_kwargs["user"] = "%s:%i" % (self.get_login_username(), os.getgid())
-        tf.write(f"umask 0002\n")  # allow sharing by default
-        tf.write(bash_script)
-        tf.flush()
-        container = client.containers.create(
-            docker_image,
-            (
-                ["/bin/bash", "/anysnake/run.sh"]
-                if root
-                else [
-                    "/anysnake/gosu",
-                    self.get_login_username(),
-                    "/bin/bash",
-                    "/anysnake/run.sh",
-                ]
-            ),
-            **run_kwargs,
-        )
+        with self._running_containers_lock:
+            if self._stop_containers:
+                raise KeyboardInterrupt()
+            container = client.containers.create(
+                docker_image,
+                (
+                    bash_cmd
+                    if root
+                    else ["/anysnake/gosu", self.get_login_username()] + bash_cmd
+                ),
+                **run_kwargs,
+            )
+            self._running_containers.add(container)
         container_result = b""
         try:
             return_code = -1
@@ -436,6 +597,9 @@ class Anysnake:
             return_code = container.wait()
         except KeyboardInterrupt:
             container.kill()
+        finally:
+            with self._running_containers_lock:
+                self._running_containers.discard(container)
 
         if hasattr(log_name, "write"):
             log_name.write(container_result)
@@ -447,6 +611,34 @@ class Anysnake:
                 self.paths[log_name].write_bytes(container_result)
         return return_code, container_result
 
+    def _materialize_script(self, bash_script):
+        """Write bash_script to a file named by its sha256 (if not present yet)
+        and return that path.
+
+        Repeated runs of the same script reuse the file.
+        Scripts unused for _max_script_age seconds are removed.
+        """
+        digest = hashlib.sha256(bash_script.encode("utf-8")).hexdigest()
+        script_dir = self.paths["per_user"] / "scripts"
+        script_dir.mkdir(exist_ok=True, parents=True)
+        script_file = script_dir / (digest + ".sh")
+        try:
+            os.utime(str(script_file))  # mark as recently used
+        except FileNotFoundError:
+            temp_file = script_dir / ("%s.%i.temp" % (digest, os.getpid()))
+            temp_file.write_text(bash_script)
+            temp_file.rename(script_file)
+            # only sweep when we add one - reuse stays a single syscall
+            cutoff = time.time() - _max_script_age
+            for entry in os.scandir(str(script_dir)):
+                try:
+                    # running containers keep their (bind mounted) copy alive
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except OSError:  # removed concurrently
+                    pass
+        return script_file
+
     def build(
         self,
         # *,
@@ -470,7 +662,18 @@ class Anysnake:
             print("Building", log_name[4:])
             build_dir = target_dir.with_name(target_dir.name + "_temp")
             if build_dir.exists():
-                shutil.rmtree(str(build_dir))
+                # move the leftovers aside (cheap) and delete them while we build
+                trash_dir = tempfile.mkdtemp(
+                    dir=str(build_dir.parent), prefix=build_dir.name + "_trash_"
+                )
+                build_dir.rename(Path(trash_dir) / build_dir.name)
+            # including those earlier runs could not remove (e.g. root owned files)
+            for trash_dir in build_dir.parent.glob(build_dir.name + "_trash_*"):
+                threading.Thread(
+                    target=shutil.rmtree,
+                    args=(str(trash_dir),),
+                    kwargs={"ignore_errors": True},
+                ).start()
             build_dir.mkdir(parents=True)
             volumes = {target_dir_inside_docker: build_dir}
             if additional_volumes:
@@ -496,40 +699,13 @@ class Anysnake:
         else:
             return False
 
-    @property
-    def major_python_version(self):
-        p = self.python_version
-        if p.count(".") == 2:
-            return p[: p.rfind(".")]
-        elif p.count(".") == 1:
-            return p
-        else:
-            raise ValueError(
-                f"Error parsing {self.anysnake.python_version} to major version"
-            )
-
     def annotate_packages(self, parsed_packages):
-        """Augment parsed packages with method"""
-        parsed_packages = parsed_packages.copy()
-        for name, entry in parsed_packages.items():
-            if "/" in name:
-                raise ValueError("invalid name: %s" % name)
-            if not entry["version"]:
-                entry["version"] = ""
-            if entry["version"].startswith("hg+https"):
-                entry["method"] = "hg"
-                entry["url"] = entry["version"][3:]
-            elif entry["version"].startswith("git+https"):
-                entry["method"] = "hg"
-                entry["url"] = entry["version"][3:]
-            elif "/" in entry["version"]:
-                if "://" in entry["version"]:
-                    raise ValueError("Could not interpret %s" % entry["version"])
-                entry["method"] = "git"
-                entry["url"] = "https://github.com/" + entry["version"]
-            else:
-                entry["method"] = "pip"
-        return parsed_packages
+        """Augment parsed packages with method (and url).
+        Returns new entries, parsed_packages is left untouched"""
+        return {
+            name: _annotate_entry(name, entry)
+            for (name, entry) in parsed_packages.items()
+        }
 
     @staticmethod
     def get_login_username():
@@ -1,5 +1,8 @@
 # -*- coding: future_fstrings -*-
 import os
+import re
+import hashlib
+import pickle
 import tempfile
 import click
 import click_completion
@@ -9,6 +12,7 @@ click_completion.init()
 
 from pathlib import Path
 from mbf_anysnake import parse_requirements, parsed_to_anysnake
+from mbf_anysnake.parser import replace_env_vars
 import subprocess
 from .util import get_next_free_port
 
@@ -32,10 +36,86 @@ def main():
 
 
 def get_anysnake():
-    parsed = parse_requirements(config_file)
+    parsed = cached_parse_requirements(config_file)
     return parsed_to_anysnake(parsed), parsed
 
 
+# bump whenever parse_requirements / _to_builtin change their output,
+# to invalidate cached_parse_requirements' results
+_parse_cache_version = 1
+
+
+def _config_fingerprint(filename):
+    """sha256 of a config file and the environment variables it references"""
+    raw = Path(filename).read_bytes()
+    h = hashlib.sha256(raw)
+    for var in sorted(set(re.findall(rb"\$\{([^}]+)\}", raw))):
+        value = os.environ.get(var.decode("utf-8"))
+        if value is None:  # left as ${var} by replace_env_vars - not the same as ""
+            h.update(var + b"\1unset\0")
+        else:
+            h.update(var + b"=" + value.encode("utf-8") + b"\0")
+    return h.hexdigest()
+
+
+def _to_builtin(value):
+    """Turn the tomlkit containers/items into plain python objects (for pickling)"""
+    if isinstance(value, dict):
+        return {str(k): _to_builtin(v) for (k, v) in value.items()}
+    elif isinstance(value, list):
+        return [_to_builtin(v) for v in value]
+    elif isinstance(value, bool):
+        return value
+    elif isinstance(value, str):
+        return str(value)
+    elif isinstance(value, int):
+        return int(value)
+    elif isinstance(value, float):
+        return float(value)
+    return getattr(value, "value", value)  # e.g. tomlkit's Bool
+
+
+def cached_parse_requirements(req_file):
+    """parse_requirements, cached in ~/.cache/anysnake.
+
+    There is one cache file per config file path. It is only used if the
+    config's content (and the environment variables it references), the
+    included config files and _parse_cache_version are unchanged.
+    """
+    cache_dir = (
+        Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "anysnake"
+    )
+    main_file = str(Path(req_file).absolute())
+    # one cache file per config file, replaced whenever it changes
+    key = hashlib.sha256(main_file.encode("utf-8")).hexdigest()
+    fingerprint = "%i\0%s" % (_parse_cache_version, _config_fingerprint(req_file))
+    cache_file = cache_dir / (key + ".pkl")
+    try:
+        with open(str(cache_file), "rb") as op:
+            cached_fingerprint, parsed, included = pickle.load(op)
+        if cached_fingerprint == fingerprint and all(
+            _config_fingerprint(fn) == fp for (fn, fp) in included
+        ):
+            return parsed
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+    parsed = _to_builtin(parse_requirements(req_file))
+    try:
+        included = [
+            (replace_env_vars(fn), _config_fingerprint(replace_env_vars(fn)))
+            for fn in parsed["used_files"]
+            if fn != main_file
+        ]
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_dir / ("%s.%i.temp" % (key, os.getpid()))
+        with open(str(temp_file), "wb") as op:
+            pickle.dump((fingerprint, parsed, included), op)
+        temp_file.rename(cache_file)
+    except OSError:  # not cachable - no harm done
+        pass
+    return parsed
+
+
 def get_volumes_config(config, key2):
     """Extract a volumes config from the config if present.
 
@@ -137,7 +217,7 @@ def shell(no_build=False, allow_writes=False, include_perf=False):
     if not no_build:
         d.ensure()
     else:
-        d.ensure_just_docker()
+        d.ensure_just_docker_cached()
     cmd = """
 if [ -f "/usr/bin/fish" ];
 then
@@ -177,7 +257,7 @@ def run(cmd, no_build=False, pre=True, post=True):
     if not no_build:
         d.ensure()
     else:
-        d.ensure_just_docker()
+        d.ensure_just_docker_cached()
 
     pre_run_outside = config.get("run", {}).get("pre_run_outside", False)
     pre_run_inside = config.get("run", {}).get("pre_run_inside", False)
@@ -223,7 +303,7 @@ def jupyter(no_build=False):
     if not no_build:
         d.ensure()
     else:
-        d.ensure_just_docker()
+        d.ensure_just_docker_cached()
     host_port = get_next_free_port(8888)
     print("Starting notebook at %i" % host_port)
     nbextensions_not_activated = not check_if_nb_extensions_are_activated()
@@ -275,7 +355,7 @@ def instant_browser(regexps, no_build=False):
     if not no_build:
         d.ensure()
     else:
-        d.ensure_just_docker()
+        d.ensure_just_docker_cached()
 
     d.mode = "instant_browser"
     d.run(
@@ -318,7 +398,7 @@ def ssh(no_build=False):
     if not no_build:
         d.ensure()
     else:
-        d.ensure_just_docker()
+        d.ensure_just_docker_cached()
     host_port = get_next_free_port(8822)
     print("Starting sshd at %i" % host_port)
     if not ".vscode-remote" in home_dirs:
@@ -3,7 +3,7 @@ import hashlib
 import os
 from pathlib import Path
 
-hash = hashlib.md5()
+hash = hashlib.sha256()
 hash.update((Path(__file__).parent / 'Dockerfile').read_bytes())
 hash.update((Path(__file__).parent / 'sudoers').read_bytes())
 tag = hash.hexdigest()
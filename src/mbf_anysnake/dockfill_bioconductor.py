@@ -1,12 +1,63 @@
 # *- coding: future_fstrings -*-
 
-import requests
 from pathlib import Path
 import re
-from .util import find_storage_path_from_other_machine, download_file
+import json
+import hashlib
+import pickle
+from html.parser import HTMLParser
+from .util import (
+    find_storage_path_from_other_machine,
+    download_file,
+    cached_get,
+    replace_atomically,
+)
+from .dockfill_python import DockFill_Python, DockFill_GlobalVenv
+from .dockfill_r import DockFill_R
+from .dockfill_rust import DockFill_Rust
+
+# (bioconductor_version, cache file mtime_ns) -> release info
+_BC_INFO_CACHE = {}
+
+re_version = re.compile(r"\d+\.\d+")
+re_package_count = re.compile(r"\d+")
+re_r_tarball = re.compile(r"R-(\d+\.\d+\.\d+)\.tar\.gz")
+# bump whenever parse_bioconductor_release_information's output changes,
+# to invalidate the parsed release page cached by
+# fetch_bioconductor_release_information
+_release_info_parser_version = 1
+
+
+class TableCollector(HTMLParser):
+    """Collect the text of every <td>, as tables -> rows -> cells,
+    in a single pass over the document"""
+
+    def __init__(self):
+        super().__init__()
+        self.tables = []
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self.tables.append([])
+        elif tag == "tr" and self.tables:
+            self.tables[-1].append([])
+        elif tag == "td" and self.tables and self.tables[-1]:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == "td" and self._cell is not None:
+            self.tables[-1][-1].append("".join(self._cell).strip())
+            self._cell = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
 
 
 class DockFill_Bioconductor:
+    deps = (DockFill_Python, DockFill_GlobalVenv, DockFill_R, DockFill_Rust)
+
     def __init__(self, anysnake, dockfill_r):
         self.anysnake = anysnake
         self.dockfill_r = dockfill_r
@@ -14,6 +65,11 @@ class DockFill_Bioconductor:
         self.bioconductor_version = anysnake.bioconductor_version
         self.bioconductor_whitelist = anysnake.bioconductor_whitelist
         self.cran_mode = anysnake.cran_mode
+        self.bioconductor_urls = {
+            "software": f"https://bioconductor.org/packages/{self.bioconductor_version}/bioc/",
+            "annotation": f"https://bioconductor.org/packages/{self.bioconductor_version}/data/annotation/",
+            "experiment": f"https://bioconductor.org/packages/{self.bioconductor_version}/data/experiment/",
+        }
 
         self.done_string = (
             "done:" + self.cran_mode + ":" + ":".join(self.bioconductor_whitelist)
@@ -67,35 +123,67 @@ class DockFill_Bioconductor:
     def pprint(self):
         print(f"  Bioconductor version={self.bioconductor_version}")
 
+    @classmethod
+    def fetch_bioconductor_release_information(cls, cache_dir=None):
+        """Retrieve (and parse) the bioconductor release announcements.
+
+        If cache_dir is set, the page is only transferred if its ETag changed,
+        and the parsed result is reused as long as the page content
+        (and _release_info_parser_version) is unchanged.
+        """
+        url = "https://bioconductor.org/about/release-announcements/"
+        if cache_dir is None:
+            import requests
+
+            return cls.parse_bioconductor_release_information(requests.get(url).text)
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        raw = cached_get(url, cache_dir / "_release_announcements.html")
+        digest = "%i:%s" % (
+            _release_info_parser_version,
+            hashlib.sha256(raw).hexdigest(),
+        )
+        parsed_cache_file = cache_dir / "_all.pkl"
+        try:
+            with open(str(parsed_cache_file), "rb") as op:
+                cached_digest, info = pickle.load(op)
+            if cached_digest == digest:
+                return info
+        except Exception:  # missing or truncated pickle - just a cache miss
+            pass
+        info = cls.parse_bioconductor_release_information(raw.decode("utf-8"))
+        replace_atomically(parsed_cache_file, pickle.dumps((digest, info)))
+        return info
+
     @staticmethod
-    def fetch_bioconductor_release_information():
+    def parse_bioconductor_release_information(bc):
         import maya
 
-        url = "https://bioconductor.org/about/release-announcements/"
-        bc = requests.get(url).text
-        tbody = bc[
-            bc.find("<tbody>") : bc.find("</tbody>")
-        ]  # at least for now it's the first table on the page
-        if not ">3.8<" in tbody:
+        collector = TableCollector()
+        # we only need the first table - don't tokenize the rest of the page
+        first_table_end = bc.find("</table>")
+        if first_table_end != -1:
+            bc = bc[: first_table_end + len("</table>")]
+        collector.feed(bc)
+        collector.close()
+        if not collector.tables:
             raise ValueError(
                 "Bioconductor relase page layout changed - update fetch_bioconductor_release_information()"
             )
         try:
             info = {}  #  release -> {'date': , 'r_major_version':
-            for block in tbody.split("</tr>"):
-                if not block.strip():
+            # at least for now it's the first table on the page
+            for tds in collector.tables[0]:
+                if not tds:  # header
                     continue
-                if block.count("<td style") != 4:
-                    print(block.count("<td style"))
+                if len(tds) != 4:
+                    print(len(tds))
                     raise ValueError(
                         "Bioconductor relase page layout changed - update fetch_bioconductor_release_information() - too few elements?"
                     )
-                tds = block.split("<td style")[1:]
-                bc_version = re.findall("\d+\.\d+", tds[0])[0]
-                release_date = tds[1][tds[1].find('">') + 2 :]
-                release_date = release_date[: release_date.find("<")]
-                package_count = re.findall(">(\d+)<", tds[2])[0]
-                r_version = re.findall(">(\d+\.\d+)<", tds[3])[0]
+                bc_version = re_version.findall(tds[0])[0]
+                release_date = tds[1]
+                package_count = re_package_count.findall(tds[2])[0]
+                r_version = re_version.findall(tds[3])[0]
 
                 release_date = maya.parse(release_date)
                 release_date = release_date.rfc3339()
@@ -111,6 +199,10 @@ class DockFill_Bioconductor:
                 "Bioconductor relase page layout changed - update fetch_bioconductor_release_information()"
             )
             raise
+        if not "3.8" in info:
+            raise ValueError(
+                "Bioconductor relase page layout changed - update fetch_bioconductor_release_information()"
+            )
 
         return info
 
@@ -124,8 +216,6 @@ class DockFill_Bioconductor:
 
         Guess you can overwrite R_version in your configuration file.
         """
-        import tomlkit
-
         anysnake.paths.update(
             {
                 "storage_bioconductor_release_info": (
@@ -138,24 +228,37 @@ class DockFill_Bioconductor:
         cache_file = anysnake.paths["storage_bioconductor_release_info"]
         if not cache_file.exists():
             cache_file.parent.mkdir(exist_ok=True, parents=True)
-            all_info = cls.fetch_bioconductor_release_information()
+            all_info = cls.fetch_bioconductor_release_information(cache_file.parent)
             if not anysnake.bioconductor_version in all_info:
                 raise ValueError(
                     f"Could not find bioconductor {anysnake.bioconductor_version} - check https://bioconductor.org/about/release-announcements/"
                 )
             info = all_info[anysnake.bioconductor_version]
             major = info["r_major_version"]
-            url = anysnake.cran_mirror + "src/base/R-" + major[0]
+            url = f"{anysnake.r_base_url}R-{major[0]}"
+            import requests
+
             r = requests.get(url).text
-            available = re.findall("R-(" + major + r"\.\d+).tar.gz", r)
-            matching = [x for x in available if x.startswith(major)]
-            by_minor = [(re.findall(r"\d+.\d+.(\d+)", x), x) for x in matching]
+            available = re_r_tarball.findall(r)
+            matching = [x for x in available if x.startswith(major + ".")]
+            by_minor = [(int(x.split(".")[2]), x) for x in matching]
             by_minor.sort()
             chosen = by_minor[-1][1]
             info["r_version"] = chosen
-            cache_file.write_text(tomlkit.dumps(info))
-        raw = cache_file.read_text()
-        return tomlkit.loads(raw)
+            cache_file.write_text(json.dumps(info))
+            key = (anysnake.bioconductor_version, cache_file.stat().st_mtime_ns)
+            _BC_INFO_CACHE[key] = info
+            return info
+        key = (anysnake.bioconductor_version, cache_file.stat().st_mtime_ns)
+        if key not in _BC_INFO_CACHE:
+            raw = cache_file.read_text()
+            try:
+                _BC_INFO_CACHE[key] = json.loads(raw)
+            except ValueError:  # cache files written by older versions are toml
+                import tomlkit
+
+                _BC_INFO_CACHE[key] = dict(tomlkit.loads(raw))
+        return _BC_INFO_CACHE[key]
 
     @classmethod
     def find_r_from_bioconductor(cls, anysnake):
@@ -184,19 +287,24 @@ class DockFill_Bioconductor:
 
             mran_url = f"https://cran.microsoft.com/snapshot/{info['date']}/"
 
-            urls = {
-                "software": f"https://bioconductor.org/packages/{self.bioconductor_version}/bioc/",
-                "annotation": f"https://bioconductor.org/packages/{self.bioconductor_version}/data/annotation/",
-                "experiment": f"https://bioconductor.org/packages/{self.bioconductor_version}/data/experiment/",
-                "cran": mran_url,
-            }
+            urls = dict(self.bioconductor_urls)
+            urls["cran"] = mran_url
+            missing = []
             for k, url in urls.items():
                 cache_path = self.paths["storage_bioconductor_download"] / (
                     k + ".PACKAGES"
                 )
                 if not cache_path.exists():
                     cache_path.parent.mkdir(exist_ok=True, parents=True)
-                    download_file(url + "src/contrib/PACKAGES", cache_path)
+                    missing.append((url + "src/contrib/PACKAGES", cache_path))
+            if missing:
+                import concurrent.futures
+
+                # these are latency bound - fetch them concurrently
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(missing)
+                ) as executor:
+                    list(executor.map(lambda x: download_file(*x), missing))
 
             bash_script = f"""
 {self.paths['docker_storage_python']}/bin/virtualenv /tmp/venv
@@ -218,7 +326,7 @@ python  {self.paths['docker_storage_bioconductor']}/_inside_dockfill_bioconducto
                 self.paths["docker_storage_python"]: self.paths["storage_python"],
                 self.paths["docker_storage_venv"]: self.paths["storage_venv"],
                 self.paths["docker_storage_r"]: self.paths["storage_r"],
-                self.paths["docker_storage_bioconductor"]
+                Path(self.paths["docker_storage_bioconductor"])
                 / "_inside_dockfill_bioconductor.py": Path(__file__).parent
                 / "_inside_dockfill_bioconductor.py",
                 self.paths["docker_storage_bioconductor_download"]: self.paths[
@@ -4,6 +4,8 @@ from .util import clone_repo
 class DockFill_Clone:
     """Just clone arbitrary repos and do nothing with them"""
 
+    deps = ()
+
     def __init__(self, anysnake):
         self.anysnake = anysnake
         self.paths = self.anysnake.paths
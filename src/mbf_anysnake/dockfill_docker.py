@@ -1,25 +1,33 @@
 # -*- coding: future_fstrings -*-
 from pathlib import Path
 import subprocess
-import docker
 import tempfile
 import shutil
 import os
+import sys
 
 
 def copytree(src, dst, symlinks=False, ignore=None):
-    """Since shutil.copytree insists that the directory must not exist
-    exist. Does not honor symlinks or ignore in top directory"""
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            shutil.copytree(s, d, symlinks, ignore)
+    """Copy src into the already existing dst.
+    Before python 3.8, shutil.copytree insists that dst must not exist -
+    the fallback does not honor symlinks or ignore in the top directory"""
+    if sys.version_info >= (3, 8):
+        # copies via the kernel (sendfile) where possible
+        shutil.copytree(src, dst, symlinks, ignore, dirs_exist_ok=True)
+        return
+    # scandir reports the entry type without an extra stat per entry.
+    # (no context manager - that needs python 3.6)
+    for entry in os.scandir(src):
+        d = os.path.join(dst, entry.name)
+        if entry.is_dir():
+            shutil.copytree(entry.path, d, symlinks, ignore)
         else:
-            shutil.copy2(s, d)
+            shutil.copy2(entry.path, d)
 
 
 class DockFill_Docker:
+    deps = ()
+
     def __init__(self, anysnake, docker_build_cmds=""):
         self.anysnake = anysnake
         self.paths = self.anysnake.paths
@@ -32,66 +40,112 @@ class DockFill_Docker:
         )
         self.docker_build_cmds = docker_build_cmds
         self.volumes = {}
+        self._dockerfile_bytes = {}  # docker_image_name -> utf-8 Dockerfile bytes
 
     def get_dockerfile_text(self, docker_image_name):
+        """The Dockerfile including the strategies' additional build commands.
+        Cached - only call once all strategies are known"""
+        return self._read_dockerfile_bytes(docker_image_name).decode("utf-8")
+
+    def _read_dockerfile_bytes(self, docker_image_name):
+        """get_dockerfile_text, but utf-8 encoded (= what is written and hashed)"""
+        if docker_image_name not in self._dockerfile_bytes:
+            self._dockerfile_bytes[docker_image_name] = self._build_dockerfile_bytes(
+                docker_image_name
+            )
+        return self._dockerfile_bytes[docker_image_name]
+
+    def _build_dockerfile_bytes(self, docker_image_name):
         b = (
             self.paths["docker_image_build_scripts"] / docker_image_name / "Dockerfile"
-        ).read_text()
+        ).read_bytes()
+        additional = ""
         for s in self.anysnake.strategies:
             if hasattr(s, "get_additional_docker_build_cmds"):
-                b += s.get_additional_docker_build_cmds()
-        b += "\n" + self.docker_build_cmds + "\n"
-        return b
+                additional += s.get_additional_docker_build_cmds()
+        additional += "\n" + self.docker_build_cmds + "\n"
+        return b + additional.encode("utf-8")
 
     def ensure(self):
         """Build (or pull) the docker container if it's not present in the system.
         pull only happens if we don't have a build script
+        (the build.sh is kept for building the images manually)
         """
-        client = docker.from_env()
-        tags_available = set()
-        for img in client.images.list():
-            tags_available.update(img.tags)
-        if self.anysnake.docker_image in tags_available:
+        import docker.errors
+
+        client = self.anysnake.get_docker_client()
+        try:
+            # one targeted lookup instead of enumerating all images
+            client.images.get(self.anysnake.docker_image)
+            return False
+        except docker.errors.ImageNotFound:
             pass
+        docker_image = self.anysnake.docker_image[
+            : self.anysnake.docker_image.rfind(":")
+        ]
+        bs = self.paths["docker_image_build_scripts"] / docker_image / "build.sh"
+        if bs.exists():
+            # the build context is only read once by docker build -
+            # keep it in ram (tmpfs) if we can
+            tmp_root = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            with tempfile.TemporaryDirectory(dir=tmp_root) as td:
+                copytree(str(bs.parent), td)
+                df = Path(td) / "Dockerfile"
+                df.chmod(0o644)
+                df.write_bytes(self._read_dockerfile_bytes(docker_image))
+                print("building", self.anysnake.docker_image)
+                print(os.listdir(td))
+                # build.sh would only recompute the tag we already have and call
+                # docker build - save the python + shell hop
+                # (BuildKit is left to docker's defaults - forcing it fails
+                # on docker >= 23 without the buildx plugin)
+                subprocess.check_call(
+                    ["docker", "build", "-t", self.anysnake.docker_image, "."],
+                    cwd=str(td),
+                )
         else:
-            docker_image = self.anysnake.docker_image[
-                : self.anysnake.docker_image.rfind(":")
-            ]
-            bs = self.paths["docker_image_build_scripts"] / docker_image / "build.sh"
-            if bs.exists():
-                with tempfile.TemporaryDirectory() as td:
-                    copytree(str(bs.parent), td)
-                    df = Path(td) / "Dockerfile"
-                    df.chmod(0o644)
-                    df.write_text(self.get_dockerfile_text(docker_image))
-                    print("having to call", bs)
-                    print(os.listdir(td))
-                    subprocess.check_call(["./build.sh"], cwd=str(td))
-            else:
-                # print(bs, "not found")
-                client.images.pull(self.anysnake.docker_image)
+            # print(bs, "not found")
+            self.pull(client)
         return False
 
+    def pull(self, client):
+        """Pull the image, reporting the layers' progress as it streams in"""
+        from docker.utils import parse_repository_tag
+
+        image = self.anysnake.docker_image
+        # handles registry:port/image without a tag
+        repository, tag = parse_repository_tag(image)
+        print("pulling", image)
+        for line in client.api.pull(
+            repository, tag or "latest", stream=True, decode=True
+        ):
+            if "error" in line:
+                raise ValueError(f"docker pull of {image} failed: {line['error']}")
+            if "progress" not in line:  # skip the per-chunk updates
+                print(" ", line.get("id", ""), line.get("status", ""))
+
     def pprint(self):
         print(f"  docker_image = {self.anysnake.docker_image}")
 
     def get_dockerfile_hash(self, docker_image_name):
         import hashlib
 
-        dockerfile = ()
-        hash = hashlib.md5()
+        hash = hashlib.sha256()
         try:
-            hash.update(self.get_dockerfile_text(docker_image_name).encode("utf-8"))
+            hash.update(self._read_dockerfile_bytes(docker_image_name))
         except FileNotFoundError:
             pass
         try:
-            hash.update(
-                (
+            with open(
+                str(
                     self.paths["docker_image_build_scripts"]
                     / docker_image_name
                     / "sudoers"
-                ).read_bytes()
-            )
+                ),
+                "rb",
+            ) as op:
+                for chunk in iter(lambda: op.read(1 << 20), b""):
+                    hash.update(chunk)
         except FileNotFoundError:
             pass
 
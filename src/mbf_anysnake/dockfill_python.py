@@ -1,11 +1,8 @@
 # -*- coding: future_fstrings -*-
-import requests
 import tempfile
 import re
 import os
 import subprocess
-import packaging.version
-import pkg_resources
 from pathlib import Path
 from .util import (
     combine_volumes,
@@ -14,10 +11,13 @@ from .util import (
     clone_repo,
     re_github,
 )
-import tomlkit
+from .dockfill_docker import DockFill_Docker
+from .dockfill_rust import DockFill_Rust
 
 
 class DockFill_Python:
+    deps = (DockFill_Docker,)
+
     def __init__(self, anysnake):
         self.anysnake = anysnake
         self.python_version = self.anysnake.python_version
@@ -88,6 +88,8 @@ echo "done"
         )
 
     def check_python_version_exists(self):
+        import requests
+
         version = self.python_version
         r = requests.get("https://www.python.org/doc/versions/").text
         if not (
@@ -102,6 +104,8 @@ echo "done"
 
 
 def safe_name(name):
+    import pkg_resources
+
     return pkg_resources.safe_name(name).lower()
 
 
@@ -125,6 +129,8 @@ echo "done"
 
 
 class Dockfill_PythonPoetry(_Dockfill_Venv_Base):
+    deps = (DockFill_Python,)
+
     def __init__(self, anysnake, dockfill_python):
         self.anysnake = anysnake
         self.paths = self.anysnake.paths
@@ -405,6 +411,8 @@ class _DockerFillVenv(_Dockfill_Venv_Base):
 
 
 class DockFill_GlobalVenv(_DockerFillVenv):
+    deps = (DockFill_Python, Dockfill_PythonPoetry, DockFill_Rust)
+
     def __init__(self, anysnake, dockfill_python):
         self.anysnake = anysnake
         self.paths = self.anysnake.paths
@@ -449,6 +457,8 @@ class DockFill_GlobalVenv(_DockerFillVenv):
 
 
 class DockFill_CodeVenv(_DockerFillVenv):
+    deps = (DockFill_Python, Dockfill_PythonPoetry, DockFill_Rust, DockFill_GlobalVenv)
+
     def __init__(self, anysnake, dockfill_python, dockfill_global_venv):
         self.anysnake = anysnake
         self.dockfill_global_venv = dockfill_global_venv
@@ -518,7 +528,7 @@ class DockFill_CodeVenv(_DockerFillVenv):
         if not pth_path.exists():
             pth_path.write_text(
                 str(
-                    self.paths["docker_storage_venv"]
+                    Path(self.paths["docker_storage_venv"])
                     / "lib"
                     / ("python" + self.anysnake.major_python_version)
                     / "site-packages"
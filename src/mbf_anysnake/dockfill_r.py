@@ -2,11 +2,14 @@
 
 import re
 from pathlib import Path
-import requests
 from .util import combine_volumes, find_storage_path_from_other_machine
+from .dockfill_docker import DockFill_Docker
+from .dockfill_python import DockFill_Python
 
 
 class DockFill_R:
+    deps = (DockFill_Docker,)
+
     def __init__(self, anysnake):
         self.anysnake = anysnake
         self.paths = self.anysnake.paths
@@ -32,11 +35,13 @@ class DockFill_R:
         print(f"  R version={self.R_version}")
 
     def check_r_version_exists(self):
+        import requests
+
         if not re.match(r"\d+\.\d+\.\d", self.R_version):
             raise ValueError(
                 "Incomplete R version specified - bust look like e.g 3.5.3"
             )
-        url = self.cran_mirror + "src/base/R-" + self.R_version[0]
+        url = f"{self.anysnake.r_base_url}R-{self.R_version[0]}"
         r = requests.get(url).text
         if not f"R-{self.R_version}.tar.gz" in r:
             raise ValueError(
@@ -45,14 +50,7 @@ class DockFill_R:
 
     def ensure(self):
         # todo: switch to cdn by default / config in file
-        r_url = (
-            self.anysnake.cran_mirror
-            + "src/base/R-"
-            + self.anysnake.R_version[0]
-            + "/R-"
-            + self.anysnake.R_version
-            + ".tar.gz"
-        )
+        r_url = f"{self.anysnake.r_base_url}R-{self.R_version[0]}/R-{self.R_version}.tar.gz"
         return self.anysnake.build(
             target_dir=self.paths["storage_r"],
             target_dir_inside_docker=self.paths["docker_storage_r"],
@@ -75,6 +73,8 @@ echo "done"
 
 
 class DockFill_Rpy2:
+    deps = (DockFill_Python, DockFill_R)
+
     def __init__(self, anysnake, dockfill_py, dockfill_r):
         self.anysnake = anysnake
         self.paths = self.anysnake.paths
@@ -1,10 +1,13 @@
 # -*- coding: future_fstrings -*-
 from .util import combine_volumes, find_storage_path_from_other_machine, download_file
+from .dockfill_docker import DockFill_Docker
 import re
 from pathlib import Path
 
 
 class DockFill_Rust:
+    deps = (DockFill_Docker,)
+
     def __init__(self, anysnake, rust_versions, cargo_install):
         self.anysnake = anysnake
         self.rust_versions = rust_versions
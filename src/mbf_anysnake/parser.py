@@ -3,7 +3,6 @@ import re
 import os
 from pathlib import Path
 from .anysnake import Anysnake
-import tomlkit
 
 
 def merge_config(d1, d2):
@@ -27,6 +26,8 @@ def parse_requirements(req_file):
     See readme.
 
     """
+    import tomlkit
+
     used_files = [str(Path(req_file).absolute())]
     with open(req_file) as op:
         p = tomlkit.loads(op.read())
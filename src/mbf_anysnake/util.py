@@ -1,14 +1,14 @@
 # -*- coding: future_fstrings -*-
 import re
-import requests
+import os
 import subprocess
 import time
 import shutil
-import time
-from docker import from_env as docker_from_env
 from pathlib import Path
 
 re_github = r"[A-Za-z0-9-]+\/[A-Za-z0-9]+"
+# shared, so repeated downloads reuse connections - see _get_session
+_session = None
 
 
 def combine_volumes(ro=[], rw=[]):
@@ -49,22 +49,108 @@ def find_storage_path_from_other_machine(anysnake, postfix, check_func=None):
     return result
 
 
+def _get_session():
+    global _session
+    if _session is None:
+        import requests
+
+        _session = requests.Session()
+    return _session
+
+
 def download_file(url, filename):
     """Download a file with requests if the target does not exist yet"""
-    if not Path(filename).exists():
-        print("downloading", url, filename)
-        r = requests.get(url, stream=True)
+    if Path(filename).exists():
+        return
+    print("downloading", url, filename)
+    with _get_session().get(url, stream=True) as r:
         if r.status_code != 200:
             raise ValueError(f"Error return on {url} {r.status_code}")
         start = time.time()
-        count = 0
-        with open(str(filename) + "_temp", "wb") as op:
-            for block in r.iter_content(1024 * 1024):
-                op.write(block)
-                count += len(block)
-        shutil.move(str(filename) + "_temp", str(filename))
-        stop = time.time()
-        print("Rate: %.2f MB/s" % ((count / 1024 / 1024 / (stop - start))))
+        r.raw.decode_content = True  # like iter_content would
+        count = write_atomically(filename, r.raw)
+    stop = time.time()
+    print("Rate: %.2f MB/s" % ((count / 1024 / 1024 / (stop - start))))
+
+
+def write_atomically(filename, fileobj):
+    """Copy fileobj into filename so that filename never exists half written.
+
+    Uses an anonymous O_TMPFILE that is linked into place once complete,
+    falling back to a temp file + rename where that's not supported.
+    Returns the number of bytes written.
+    """
+    filename = os.path.abspath(str(filename))
+    dir_fd = os.open(os.path.dirname(filename), os.O_RDONLY)
+    try:
+        try:
+            fd = os.open(".", os.O_TMPFILE | os.O_RDWR, 0o644, dir_fd=dir_fd)
+        except (AttributeError, OSError):  # not linux, or fs without O_TMPFILE
+            return _write_via_temp_file(filename, fileobj)
+        with os.fdopen(fd, "w+b") as op:
+            shutil.copyfileobj(fileobj, op, 1024 * 1024)
+            count = op.tell()
+            op.flush()
+            try:
+                # passing a dir_fd makes python use linkat(AT_SYMLINK_FOLLOW),
+                # required to link the /proc fd symlink's target
+                os.link(
+                    "/proc/self/fd/%i" % fd,
+                    os.path.basename(filename),
+                    dst_dir_fd=dir_fd,
+                )
+            except FileExistsError:
+                pass  # a concurrent download finished first
+            except OSError:  # e.g. no /proc - copy it out of the O_TMPFILE instead
+                op.seek(0)
+                _write_via_temp_file(filename, op)
+        return count
+    finally:
+        os.close(dir_fd)
+
+
+def _write_via_temp_file(filename, fileobj):
+    temp_filename = "%s_temp%i" % (filename, os.getpid())
+    with open(temp_filename, "wb") as op:
+        shutil.copyfileobj(fileobj, op, 1024 * 1024)
+        count = op.tell()
+    shutil.move(temp_filename, filename)
+    return count
+
+
+def replace_atomically(filename, data):
+    """Replace filename with data (bytes) via temp file + rename,
+    so readers never see it half written"""
+    filename = Path(filename)
+    temp_file = filename.with_name("%s.%i.temp" % (filename.name, os.getpid()))
+    temp_file.write_bytes(data)
+    temp_file.rename(filename)
+
+
+def cached_get(url, cache_path):
+    """GET url, keeping the body in cache_path and the ETag next to it.
+
+    If the server reports the cached copy as unmodified (304),
+    the cached body is returned without transferring it again.
+    Returns bytes.
+    """
+    cache_path = Path(cache_path)
+    etag_path = cache_path.with_name(cache_path.name + ".etag")
+    headers = {}
+    if cache_path.exists() and etag_path.exists():
+        headers["If-None-Match"] = etag_path.read_text()
+    r = _get_session().get(url, headers=headers)
+    if r.status_code == 304:
+        return cache_path.read_bytes()
+    if r.status_code != 200:
+        raise ValueError(f"Error return on {url} {r.status_code}")
+    # drop the old ETag first - it must never be paired with another body
+    if etag_path.exists():
+        etag_path.unlink()
+    replace_atomically(cache_path, r.content)
+    if "ETag" in r.headers:
+        replace_atomically(etag_path, r.headers["ETag"].encode("utf-8"))
+    return r.content
 
 
 def dict_to_toml(d):
@@ -81,6 +167,8 @@ def dict_to_toml(d):
 
 
 def find_docker_ports():
+    from docker import from_env as docker_from_env
+
     client = docker_from_env()
     res = set()
     for container in client.containers.list():
@@ -95,23 +183,22 @@ def find_docker_ports():
 def get_next_free_port(start_at):
     import socket
 
-    try_next = True
-    port = start_at
     docker_ports = find_docker_ports()
-    while try_next:
-        try:
+    # a failed bind leaves the socket unbound, so one socket serves all probes
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        for port in range(start_at, start_at + 101):
             if port in docker_ports:
-                raise ValueError()
-            s = socket.socket()
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(("localhost", port))
-            s.close()
-            try_next = False
-        except (socket.error, ValueError):
-            port += 1
-        if port > start_at + 100:
-            raise ValueError("No empty port found within search range")
-    return port
+                continue
+            try:
+                s.bind(("localhost", port))
+                return port
+            except socket.error:
+                pass
+    finally:
+        s.close()
+    raise ValueError("No empty port found within search range")
 
 
 def clone_repo(url, name, target_path, log_file):